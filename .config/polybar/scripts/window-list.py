@@ -1,14 +1,20 @@
 #!/usr/bin/env python
 
 import argparse
+import collections.abc
+import concurrent.futures
+import math
 import os
 import pathlib
 import re
+import selectors
+import shutil
 import signal
+import socket
 import stat
 import subprocess
 import sys
-import threading
+import time
 import typing
 
 
@@ -16,130 +22,221 @@ class Node(object):
     """Represents a node with an attached window.
     :param kwargs: Dictionary of columns from wmctrl line
     """
+    __slots__ = ("id", "app_name", "win_name")
 
     def __init__(self, **kwargs):
         """Constructor method
         """
         self.id = kwargs.get("id")
-        self.desktop_id = kwargs.get("desktop")
-        self.pid = kwargs.get("pid")
-        self.geometry = kwargs.get("geometry")
         self.app_name = kwargs.get("class")
         self.win_name = kwargs.get("title")
 
     @property
     def attrs(self) -> dict:
-        return {
-            "id": self.id,
-            "desktop": self.desktop_id,
-            "pid": self.pid,
-            "geometry": self.geometry,
-            "class": self.app_name,
-            "title": self.win_name
-        }
+        return {"id": self.id, "class": self.app_name, "title": self.win_name}
 
-    @attrs.setter
-    def attrs(self, info: dict):
-        new_node = Node(
-            id=info["id"],
-            desktop_id=info["desktop"],
-            pid=info["pid"],
-            geometry=info["geometry"],
-            app_name=info["class"],
-            win_name=info["title"]
-        )
-        return new_node
+
+class CommandSession(object):
+    """Sends messages to bspwm over its UNIX socket, following the same wire
+    protocol as 'bspc', so that a query does not fork a new process.
+
+    :param socket_path: Path to the bspwm socket, resolved from the
+        environment when omitted
+    """
+    FAILURE_MESSAGE = b"\x07"
+    RECV_SIZE = 4096
+
+    def __init__(self, socket_path=None):
+        """Constructor method
+        """
+        self._socket_path = socket_path
+        if socket_path is None:
+            self._socket_path = self.default_socket_path()
+
+    @staticmethod
+    def default_socket_path() -> str:
+        """Resolves the socket path the same way bspwm does: BSPWM_SOCKET if
+        set, otherwise derived from the X display name
+
+        :return: Path to the bspwm socket
+        """
+        socket_path = os.getenv("BSPWM_SOCKET")
+        if socket_path:
+            return socket_path
+        host, _, display = os.getenv("DISPLAY", "").rpartition(":")
+        display_num, _, screen_num = display.partition(".")
+        return f"/tmp/bspwm{host}_{display_num or 0}_{screen_num or 0}-socket"
+
+    def connect(self, *args: str) -> socket.socket:
+        """Opens a connection and sends the given arguments as one message;
+        each argument is terminated by a NUL byte
+
+        :param args: Arguments as they would be passed to 'bspc'
+        :return: Connected socket for reading the response
+        :raises OSError: The bspwm socket is not available
+        """
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(self._socket_path)
+            sock.sendall(b"".join(arg.encode() + b"\0" for arg in args))
+        except OSError:
+            sock.close()
+            raise
+        return sock
+
+    def _receive(self, sock: socket.socket) -> str:
+        """Reads a response until bspwm closes the connection
+
+        :param sock: Connected socket that a message was sent through
+        :return: Response text, or an empty string when bspwm reports failure
+        """
+        chunks = []
+        for chunk in iter(lambda: sock.recv(self.RECV_SIZE), b""):
+            chunks.append(chunk)
+        response = b"".join(chunks)
+        if response.startswith(self.FAILURE_MESSAGE):
+            return ""
+        return response.decode()
+
+    def send(self, *args: str) -> str:
+        """Sends a message and reads its response
+
+        :param args: Arguments as they would be passed to 'bspc'
+        :return: Response text, or an empty string when bspwm reports failure
+        """
+        with self.connect(*args) as sock:
+            return self._receive(sock)
+
+    def send_batch(
+        self, *messages: typing.Sequence[str]
+    ) -> typing.List[str]:
+        """Sends all messages before reading any response, so that bspwm
+        handles them back to back rather than one round trip at a time
+
+        :param messages: Arguments of each message, as for :meth:`send`
+        :return: Response text of each message, in the same order
+        """
+        socks = []
+        try:
+            for message in messages:
+                socks.append(self.connect(*message))
+            return [self._receive(sock) for sock in socks]
+        finally:
+            for sock in socks:
+                sock.close()
 
 
 class EventListener(object):
-    """Subscribes to bspwm events using 'bspc subscribe'.
+    """Subscribes to bspwm events over the bspwm socket, as 'bspc subscribe'
+    would. The listener is a file object, to be waited on with a selector.
+
+    :param session: Session for sending messages to bspwm
     """
-    EVENTS = [
+    # only events that can change the window list; e.g. a desktop layout
+    # change does not, and would only cost a render
+    EVENTS = (
         "desktop_focus",
-        "desktop_layout",
         "node_focus",
         "node_remove",
         "node_transfer",
-    ]
+    )
+    SUBSCRIBE = ("subscribe", *EVENTS)
+    RECV_SIZE = 4096
 
-    @classmethod
-    def start(cls) -> typing.Iterator[str]:
-        """A generator for triggered events that 'bspc subscribe' observes
+    def __init__(self, session: CommandSession = None):
+        """Constructor method
+        """
+        self._session = session
+        if session is None:
+            self._session = CommandSession()
+        self._sock: socket.socket = None
+        self._buffer = b""  # trailing incomplete event
 
-        :return: Representation of event (see 'man bspc' for event format)
-        :raises CalledProcessError: Non-zero return code and the signal
+    def start(self):
+        """Opens the subscription; events are then read without blocking
+
+        :raises OSError: The bspwm socket is not available
         """
-        cmd = "bspc subscribe".split()
-        cmd.extend(cls.EVENTS)
-        event_pipe = subprocess.Popen(cmd, stdout=subprocess.PIPE, text=True)
-        for event in iter(event_pipe.stdout.readline, ""):
-            yield event  # events from captured stdout of bspc subscribe
+        self._sock = self._session.connect(*self.SUBSCRIBE)
+        self._sock.setblocking(False)
 
-        event_pipe.stdout.close()
-        ret_code = event_pipe.wait()  # determine exit status and report fails
-        raise subprocess.CalledProcessError(ret_code, cmd)
+    def stop(self):
+        """Closes the subscription
+        """
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
+
+    def fileno(self) -> int:
+        return self._sock.fileno()
+
+    def read_events(self) -> typing.List[str]:
+        """Reads the events that arrived since the last read. All pending
+        events are drained, so that a burst of them is handled at once
+
+        :return: Representation of events (see 'man bspc' for event format)
+        :raises ConnectionError: bspwm closed the subscription
+        """
+        chunks = [self._buffer]
+        while True:
+            try:
+                chunk = self._sock.recv(self.RECV_SIZE)
+            except BlockingIOError:
+                break
+            if not chunk:
+                raise ConnectionError("bspwm closed the event subscription")
+            chunks.append(chunk)
+        *events, self._buffer = b"".join(chunks).split(b"\n")
+        return [event.decode() for event in events]
 
 
 class NodeDriver(object):
-    """Queries the state of bspwm nodes using 'bspc query'.
+    """Queries the state of bspwm nodes, as 'bspc query' would, through the
+    bspwm socket.
+
+    :param session: Session for sending messages to bspwm
     """
     QUERIES = {
-        "focused": "bspc query -N -n focused.window".split(),
-        "local": "bspc query -N -n .local.window".split(),
-        "same_class": "bspc query -N -n .local.same_class".split(),
-        "flags": "bspc wm --get-status".split(),
+        "focused": ("query", "-N", "-n", "focused.window"),
+        "local": ("query", "-N", "-n", ".local.window"),
+        "same_class": ("query", "-N", "-n", ".local.same_class"),
     }
 
-    def _safe_hex_to_dec(self, node_id: str) -> int:
-        """A query output is typically in hex (0x..) format; therefore,
-        it is mapped into int for ease of comparison
-
-        :param node_id: The id number of node in base-16
-        :return: Node id in base-10
+    def __init__(self, session: CommandSession = None):
+        """Constructor method
         """
-        id = 0
-        try:
-            id = int(node_id, 16)
-        except ValueError:
-            pass
-        return id
+        self._session = session
+        if session is None:
+            self._session = CommandSession()
 
-    def _select(self, query_id: str) -> typing.Iterable[int]:
-        """A general querying method that returns a formatted list from the
-        resulting raw output
+    def _select(self, query_id: str) -> str:
+        """A general querying method that returns the raw output
 
         :param query_id: An id from this class' QUERIES dictionary
-        :return: List of node id
+        :return: Query output
         """
-        cmd = self.QUERIES.get(query_id)
-        pipe = subprocess.run(cmd, capture_output=True, text=True)
-        return pipe.stdout.rstrip().split("\n")
+        message = self.QUERIES.get(query_id)
+        return self._session.send(*message)
 
-    def _id_map(self, output: list) -> typing.Iterable[int]:
-        """Maps the given lines of node id from a query into a list of integers
+    def _id_map(self, output: str) -> typing.Iterable[int]:
+        """Maps the node ids of a query output, which are in hex (0x..) format,
+        into a list of integers for ease of comparison
 
-        :param output: Lines from query output
+        :param output: Query output
         :return: List of node id
         """
-        return list(
-            filter(lambda n: n != 0, map(self._safe_hex_to_dec, output))
-        )
-
-    def _report_map(self, status: str) -> dict:
-        """Maps the report line from probing the overall status
+        return [int(node_id, 16) for node_id in output.split()]
 
-        :param output: Full line from status report
-        :return: Hashed montior id and its state
+    def query_state(self) -> typing.Tuple[list, list]:
+        """Queries the focused node and the nodes in the reference desktop in
+        a single batch
+        :return: Focused node id, and list of node id in reference desktop
         """
-        result = {}
-        if status == "":
-            return result
-
-        report = re.split(r"[W:][Mm]", status)[1:]
-        for rep in report:
-            monitor, *state = rep.split(":")
-            result[monitor] = state
-        return result
+        output = self._session.send_batch(
+            self.QUERIES["focused"], self.QUERIES["local"]
+        )
+        node_focused_id, node_win_id = map(self._id_map, output)
+        return node_focused_id, node_win_id
 
     def query_focused(self) -> typing.Iterable[int]:
         """Queries the currently focused node id in base-10
@@ -163,68 +260,115 @@ class NodeDriver(object):
         node_cls_id = self._id_map(self._select("same_class"))
         return node_cls_id
 
-    def report(self) -> dict:
-        """Returns a report of the current state of all monitors
-        :return: Hashed monitor id and its state
+
+class WindowInfoMap(collections.abc.Mapping):
+    """Window information keyed by window id. A line from 'wmctrl' is only
+    indexed by its id up front, and parsed when the id is first looked up,
+    since most windows are on other desktops and never rendered.
+
+    :param lines: Lines from 'wmctrl' list output, undecoded
+    :param parser: Maps a line into its hashed column names and values
+    """
+
+    def __init__(
+        self,
+        lines: typing.Iterable[bytes],
+        parser: typing.Callable[[bytes], dict],
+    ):
+        """Constructor method
         """
-        report = self._report_map(self._select("flags"))
-        return report
+        self._parser = parser
+        self._parsed = {}
+        # the window id is the first column, in hex (0x..)
+        self._lines = {int(line.split(None, 1)[0], 16): line for line in lines}
+
+    def __getitem__(self, id: int) -> dict:
+        try:
+            return self._parsed[id]
+        except KeyError:
+            wminfo = self._parsed[id] = self._parser(self._lines[id])
+            return wminfo
+
+    def __contains__(self, id) -> bool:
+        return id in self._lines
+
+    def __iter__(self) -> typing.Iterator[int]:
+        return iter(self._lines)
+
+    def __len__(self) -> int:
+        return len(self._lines)
 
 
 class WindowInfoDriver(object):
-    """Retrieves window information for all windows using 'wmctrl'.
+    """Retrieves window information for all windows using 'wmctrl'. The last
+    result is reused while it is younger than CACHE_TTL, so that a burst of
+    events, or an event right after a refresh, does not fork 'wmctrl' again.
     """
+    # time in miliseconds that a fetched info map remains valid
+    CACHE_TTL = 200
+
+    def __init__(self):
+        """Constructor method
+        """
+        self._cache = (0, None)  # (monotonic time in ns, info map)
+        # resolved once, rather than searched in PATH on every call
+        self._cmd = [shutil.which("wmctrl") or "wmctrl", "-xl"]
 
-    def _map_wmctrl_line(self, line: str) -> dict:
+    def _to_ascii(self, text: bytes) -> str:
+        return text.decode("ascii", errors="ignore")
+
+    def _map_wmctrl_line(self, line: bytes) -> dict:
         """Maps lines from 'wmctrl' into a dictionary of each column:
 
         col header
         --- ------
         0   window id
         1   desktop id
-        2   pid
-        3-6 geometry (x-offset, y-offset, width, height)
-        7   class name
-        8   hostname
-        9   window title
+        2   class name
+        3   hostname
+        4   window title
+
+        Only the columns that the labels need are kept; the desktop id and
+        hostname are skipped.
 
-        :param line: A line from 'wmctrl' list output
+        :param line: A line from 'wmctrl' list output, undecoded; only the
+            text columns are decoded, dropping any non-ascii characters
         :return: Hashed column names with its values
         """
-        # filter out redundant whitespace special characters
-        wminfo = " ".join(
-            line.encode("ascii", errors="ignore").decode().split()
-        )
-        # parse columns
-        wminfo = wminfo.split(" ", 9)
+        # parse columns, splitting on any run of whitespace
+        wminfo = line.split(None, 4)
         wminfo_hash = {
-            "id": int(wminfo[0], 0),
-            "desktop": int(wminfo[1]),
-            "pid": int(wminfo[2]),
-            "geometry": tuple(map(int, wminfo[3:7])),
-            "class": wminfo[7].split(".")[-1].lower(),
+            "id": int(wminfo[0], 16),
+            "class": self._to_ascii(wminfo[2]).split(".")[-1].lower(),
         }
-        try:
-            wminfo_hash.update(title=wminfo[9])
-        except IndexError:
-            wminfo_hash.update(title=wminfo_hash["class"])
-        finally:
-            return wminfo_hash
-
-    def get_info_map(self) -> dict:
-        """Retrieves info of all windows in every desktop
+        title = ""
+        if len(wminfo) > 4:
+            # filter out redundant whitespace left by non-ascii characters
+            title = " ".join(self._to_ascii(wminfo[4]).split())
+        wminfo_hash.update(title=title or wminfo_hash["class"])
+        return wminfo_hash
+
+    def get_info_map(self, max_age=None) -> WindowInfoMap:
+        """Retrieves info of all windows in every desktop. The returned map may
+        be shared with other callers, and must not be modified
+
+        :param max_age: Time in miliseconds that a cached result is accepted,
+            CACHE_TTL when omitted
         :return: Hashed window ids with its property values
         """
-        cmd = "wmctrl -pGxl".split()
-        pipe = subprocess.run(cmd, capture_output=True, text=True)
-        out = pipe.stdout.rstrip().split("\n")
+        if max_age is None:
+            max_age = self.CACHE_TTL
+        fetched_at, result = self._cache
+        now = time.monotonic_ns()
+        if result is not None and now - fetched_at < max_age * 1e6:
+            return result
 
-        result = {}
-        for line in filter(lambda n: n != "", out):
-            tokenized_line = self._map_wmctrl_line(line)
-            id = tokenized_line.pop("id", 0)  # extract window id
+        pipe = subprocess.run(self._cmd, capture_output=True)
+        lines = (line for line in pipe.stdout.splitlines() if line)
 
-            result[id] = tokenized_line  # key: window id, value: props
+        # key: window id, value: props (including the id)
+        result = WindowInfoMap(lines, self._map_wmctrl_line)
+        self._cache = (now, result)
         return result
 
 
@@ -242,66 +386,100 @@ class WindowListRepo(object):
         """
         self._d_node = node_driver
         self._d_wminfo = wminfo_driver
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
 
     def _map_to_domain(
         self,
         node_id: list,
         wminfo_hash: dict,
+        filter=None,
     ) -> typing.Iterator[dict]:
         for id in node_id:
-            if id not in wminfo_hash:
+            if id not in wminfo_hash or (filter and id in filter):
                 continue
-            node = Node(id=id, **wminfo_hash[id])
-            yield node.attrs
-
-    def _filter(self, hash_map: dict, filter: list) -> list:
-        result = []
-        if filter is not None:
-            result = [hash_map.pop(id, None) for id in filter]
-        return result
+            # same keys as Node.attrs, without building a Node per window;
+            # shared with the info map, so it must not be modified
+            yield wminfo_hash[id]
 
     def _group(self, winlist: typing.Iterable[dict], group="class") -> list:
         return sorted(winlist, key=lambda i: i.get(group, ""))
 
-    def get_focused_window(self) -> dict:
+    def snapshot(self, wminfo_max_age=None) -> dict:
+        """Fetches the state of bspwm nodes and the window information in one
+        batch. The window information, which forks 'wmctrl', is fetched in the
+        background while the bspwm socket is queried, so the wait is about as
+        long as the slower of the two rather than their sum
+
+        :param wminfo_max_age: Time in miliseconds that cached window info is
+            accepted (see :meth:`WindowInfoDriver.get_info_map`); it is always
+            fetched again when a node is missing from it
+        :return: Hashed query ids with their node ids, and the window info
+            map under "wminfo"
+        """
+        wminfo = self._executor.submit(
+            self._d_wminfo.get_info_map, wminfo_max_age
+        )
+        node_focused, node_win_id = self._d_node.query_state()
+        result = {
+            "focused": node_focused,
+            "local": node_win_id,
+            # same class only applies as a reference to a focused window
+            "same_class":
+                self._d_node.query_local_class() if node_focused else [],
+            "wminfo": wminfo.result(),
+        }
+
+        # a cached info map predating a new window is fetched again
+        if any(id not in result["wminfo"] for id in result["local"]):
+            result["wminfo"] = self._d_wminfo.get_info_map(max_age=0)
+        return result
+
+    def get_focused_window(self, snapshot=None) -> dict:
         """Gets the window properties of the currently focused window. The dict
         keys match the description from :class:`Node`
 
+        :param snapshot: State from :meth:`snapshot`, fetched when omitted
         :return: Window properties of the focused node
         """
-        node_focused = self._d_node.query_focused()
-        wminfo_hash = self._d_wminfo.get_info_map()
+        if snapshot is None:
+            snapshot = self.snapshot()
 
-        result = list(self._map_to_domain(node_focused, wminfo_hash))
-        if len(result) == 0:
-            return {}
-        return result.pop()
+        # at most one node is focused
+        result = self._map_to_domain(snapshot["focused"], snapshot["wminfo"])
+        return next(result, {})
 
-    def get_same_class_windows(self, filter=None) -> list:
+    def get_same_class_windows(self, filter=None, snapshot=None) -> list:
         """Gets a list of windows and its properties that are in the same class
         as the reference window. They match the description from :class:`Node`
 
+        :param filter: nodes to filter out from final result
+        :param snapshot: State from :meth:`snapshot`, fetched when omitted
         :return: List of nodes of the same class, and their window properties
         """
-        node_cls_id = self._d_node.query_local_class()
-        wminfo_hash = self._d_wminfo.get_info_map()
+        if snapshot is None:
+            snapshot = self.snapshot()
 
-        self._filter(wminfo_hash, filter)
-        result = list(self._map_to_domain(node_cls_id, wminfo_hash))
+        result = list(
+            self._map_to_domain(
+                snapshot["same_class"], snapshot["wminfo"], filter
+            )
+        )
         return result
 
-    def get_window_list(self, filter=None) -> list:
+    def get_window_list(self, filter=None, snapshot=None) -> list:
         """Gets a list of windows and its properties, matching the description
         from :class:`Node`
 
         :param filter: nodes to filter out from final result
+        :param snapshot: State from :meth:`snapshot`, fetched when omitted
         :return: List of nodes and their window properties
         """
-        node_win_id = self._d_node.query_local_windows()
-        wminfo_hash = self._d_wminfo.get_info_map()
+        if snapshot is None:
+            snapshot = self.snapshot()
 
-        self._filter(wminfo_hash, filter)
-        result = self._group(self._map_to_domain(node_win_id, wminfo_hash))
+        result = self._group(
+            self._map_to_domain(snapshot["local"], snapshot["wminfo"], filter)
+        )
         return result
 
 
@@ -322,11 +500,40 @@ class WindowInfoFormatter(object):
     OVERFLOW = ".."
     # separator between class name and window title for the focused label
     DELIM_FOCUSED = " - "
+    # leading separator to strip from the title of the focused label
+    STRIP_PATTERN = re.compile(r"^[^\w]*?- +")
     # surrounding character for window titles
     # if paren, bracket, brace, then must be open type
     SURROUND_CHAR = "["
     # left-right padding for window title
     PADDING = 1
+    # placeholder for the variable parts of a label template
+    HOLE = "\0"
+
+    def __init__(self):
+        """Constructor method. The label styles only depend on the class
+        constants, so each is rendered once around placeholders and split
+        into the literal parts that surround the variable text.
+        """
+        hole = self.HOLE
+        focused_cls = self._set_fg_color(
+            hole + self.DELIM_FOCUSED, self.FG_FOCUSED_CLS
+        )
+        focused_name = self._set_fg_color(
+            self._set_surround(hole), self.FG_FOCUSED
+        )
+        self._focused_parts = self._set_bg_color(
+            self._set_padding(focused_cls + focused_name), self.BG_FOCUSED
+        ).split(hole)
+        self._inactive_parts = self._set_fg_color(
+            self._set_padding(self._set_surround(hole)), self.FG_DIMMED
+        ).split(hole)
+        self._same_class_parts = self._set_fg_color(
+            self._set_bg_color(
+                self._set_padding(self._set_surround(hole)), self.BG_SAME_CLASS
+            ),
+            self.FG_SAME_CLASS,
+        ).split(hole)
 
     def _set_bg_color(self, title: str, color: str) -> str:
         return f"%{{B{color}}}{title}%{{B-}}"
@@ -353,64 +560,54 @@ class WindowInfoFormatter(object):
         :param title: A window title
         :return: Title of fixed length
         """
-        title = title.ljust(limit, " ")
         if len(title) > limit:
             cut_index = limit - len(self.OVERFLOW)
-            title = title[:cut_index] + self.OVERFLOW
-        return title
+            return title[:cut_index] + self.OVERFLOW
+        return title.ljust(limit, " ")
 
     def _strip_focused_delim(
         self, pattern: typing.Pattern[str], label: str
     ) -> str:
         """Strip out the left substring of title that matches the given pattern
-        :param pattern: Substring to strip from title
+        :param pattern: Compiled pattern of substring to strip from title
         :param title: A focused window label
         """
-        cls, name = label.split(self.DELIM_FOCUSED, 1)
-        name = re.sub(pattern, "", name)
+        cls, _, name = label.partition(self.DELIM_FOCUSED)
+        if "- " not in name:
+            return label  # pattern cannot match; skip the regex
+        name = pattern.sub("", name, count=1)
         return cls + self.DELIM_FOCUSED + name
 
     def style_focused(self, title: str) -> str:
         """Returns a stylized window title for a focused node
         :param title: A window title
         """
-        label = self._strip_focused_delim(r"^[^\w]*?- +", title)
+        label = self._strip_focused_delim(self.STRIP_PATTERN, title)
         label = self._clamp_title(label, self.LABEL_SIZE_FOCUSED)
 
-        cls = name = ""
-        try:
-            cls, name = label.split(self.DELIM_FOCUSED, 1)
-        except ValueError:
+        cls, delim, name = label.partition(self.DELIM_FOCUSED)
+        if not delim:
             cls = "UNKNOWN"
             name = "".ljust(
                 self.LABEL_SIZE_FOCUSED - len(self.DELIM_FOCUSED) - len(cls)
             )
-        label = self._set_fg_color(
-            cls + self.DELIM_FOCUSED, self.FG_FOCUSED_CLS
-        ) + self._set_fg_color(self._set_surround(name), self.FG_FOCUSED)
-        label = self._set_padding(label)
-        label = self._set_bg_color(label, self.BG_FOCUSED)
-        return label
+        head, middle, tail = self._focused_parts
+        return head + cls + middle + name + tail
 
     def style_inactive(self, title: str) -> str:
         """Returns a stylized window title for an unfocused/inactive node
         :param title: A window title
         """
-        title = self._set_surround(self._clamp_title(title, self.LABEL_SIZE))
-        title = self._set_padding(title)
-        title = self._set_fg_color(title, self.FG_DIMMED)
-        return title
+        head, tail = self._inactive_parts
+        return head + self._clamp_title(title, self.LABEL_SIZE) + tail
 
     def style_same_class(self, title: str) -> str:
         """Returns a stylized window title for a node with the same class as
         the focused node
         :param title: A window title
         """
-        title = self._set_surround(self._clamp_title(title, self.LABEL_SIZE))
-        title = self._set_padding(title)
-        title = self._set_bg_color(title, self.BG_SAME_CLASS)
-        title = self._set_fg_color(title, self.FG_SAME_CLASS)
-        return title
+        head, tail = self._same_class_parts
+        return head + self._clamp_title(title, self.LABEL_SIZE) + tail
 
 
 class WindowListInteractor(object):
@@ -427,87 +624,28 @@ class WindowListInteractor(object):
         self._repo = repo
         self._formatter = formatter
 
-    def get_output(self):
-        node_focused = self._repo.get_focused_window()
+    def get_output(self, wminfo_max_age=None):
+        snapshot = self._repo.snapshot(wminfo_max_age)
+        node_focused = self._repo.get_focused_window(snapshot)
         node_focused_id = node_focused.get("id", None)
-        filter = [node_focused_id] if node_focused_id else []
+        filter = {node_focused_id} if node_focused_id else set()
 
-        node_cls_list = self._repo.get_same_class_windows(filter)
+        node_cls_list = []
         if node_focused_id:
-            filter += map(lambda n: n.get("id", 0), node_cls_list)
+            node_cls_list = self._repo.get_same_class_windows(filter, snapshot)
+            filter.update(n["id"] for n in node_cls_list)
 
-        node_list = self._repo.get_window_list(filter)
+        node_list = self._repo.get_window_list(filter, snapshot)
 
-        result = ""
+        result = []
         if node_focused_id:
             title = node_focused["class"] + " - " + node_focused["title"]
-            result += self._formatter.style_focused(title)
+            result.append(self._formatter.style_focused(title))
         for n in node_cls_list:
-            result += self._formatter.style_same_class(n["title"])
+            result.append(self._formatter.style_same_class(n["title"]))
         for n in node_list:
-            result += self._formatter.style_inactive(n["title"])
-        return result
-
-
-class ThreadedRefresh(threading.Thread):
-    """A thread to be started while waiting for the next input/event.
-    Runs the given target at equal intervals until thread is stopped.
-    The returned object may be printed to stdout, or redirected with a
-    custom printer.
-
-    :effects: Writes to stdout, or redirected output through custom printer
-    :param interval: Time in miliseconds between calls to target
-    :param target: Function to invoke
-    :param start_delay: Delay before the first invocation of target
-    :param timeout: Time in miliseconds for thread to expire
-    :param printer: Writer for return object of target
-    """
-
-    def __init__(
-        self,
-        interval: int,
-        target,
-        *,
-        start_delay=1000,
-        timeout=6e5,
-        printer=print
-    ):
-        super().__init__(target=target)
-
-        self.interval = interval
-        self.start_delay = start_delay
-        self.timeout = timeout
-        self.printer = printer
-
-        self._target = target
-        self._terminate = threading.Event()
-
-    def run(self):
-        """Method representing the thread's activity.
-        Invokes the callable object passed to the object's constructor as the
-        target argument.
-        """
-        try:
-            iter_count = 0
-            self._terminate.wait(self.start_delay / 1000)
-            while not self.stopped:
-                self.printer(self._target())
-                self._terminate.wait(self.interval / 1000)
-                if self.interval * iter_count > self.timeout:
-                    self.stop()
-                iter_count += 1
-        finally:
-            del self._target
-
-    def stop(self):
-        """Sets flag to terminate all activity. Waits on printer and target to
-        finish before termination.
-        """
-        self._terminate.set()
-
-    @property
-    def stopped(self) -> bool:
-        return self._terminate.is_set()
+            result.append(self._formatter.style_inactive(n["title"]))
+        return "".join(result)
 
 
 class Controller(object):
@@ -517,6 +655,15 @@ class Controller(object):
     """
     CACHE_DIR = os.getenv("HOME") + "/.cache/polybar"
     HOOK_TAIL_ID = 1
+    # periodic refresh for changes without a bspwm event (e.g. window titles),
+    # all in miliseconds: delay after an event, interval between refreshes,
+    # and time after the last event for refreshes to stop
+    REFRESH_DELAY = 1000
+    REFRESH_INTERVAL = 500
+    REFRESH_TIMEOUT = 6e5
+    # interval between refreshes once this many in a row changed nothing
+    REFRESH_BACKOFF_COUNT = 4
+    REFRESH_BACKOFF_INTERVAL = 2000
 
     def __init__(self, polybar_pid=0, polybar_cache=None):
         """Constructor method
@@ -526,6 +673,9 @@ class Controller(object):
         self._polybar_cache = polybar_cache
         if polybar_cache is None:
             self._polybar_cache = f"{self.CACHE_DIR}/window-list"
+        self._cache_fd: int = None
+        self._hook_fd: int = None
+        self._last_output = None
 
     def __del__(self):
         """Destructor method
@@ -533,7 +683,7 @@ class Controller(object):
         self._handle_cleanup()
 
     def _destroy(self, sig: int = 0, frame=None):
-        """Meant to be used with a signal trap. The traps are setup when the
+        """Meant to be used with a signal trap. The traps are setup before the
         cache file is created. When an INT, QUIT, or TERM signal is received,
         this method is called.
 
@@ -552,24 +702,37 @@ class Controller(object):
     def _handle_cleanup(self):
         """Helper for destructor and destroy signals while listening to events
         """
+        if self._cache_fd is not None:
+            os.close(self._cache_fd)
+            self._cache_fd = None
+        if self._hook_fd is not None:
+            os.close(self._hook_fd)
+            self._hook_fd = None
         if os.path.isfile(self._polybar_cache):
             os.remove(self._polybar_cache)
 
-    def _redirect_output(self, output):
+    def _redirect_output(self, output) -> bool:
         """Helper for redirecting output based on state of Controller, or the
         passed args when starting this script.
 
         :effects: Writes to stdout or temporary file
         :param output: The formatted output to write
+        :return: False if output is unchanged from the last, and was skipped
         """
+        if output == self._last_output:
+            return False  # spare the write and polybar a redraw
+        self._last_output = output
+
         if self._polybar_pid == 0:
-            # default behaviour
-            print(output)
-            return
-        # non-zero pid; write to polybar cache and notify
-        with open(self._polybar_cache, "w+") as f:
-            print(output, file=f)
+            # default behaviour; flushed, as stdout is a pipe when tailed
+            sys.stdout.write(output + "\n")
+            sys.stdout.flush()
+            return True
+        # non-zero pid; overwrite polybar cache in place and notify
+        os.ftruncate(self._cache_fd, 0)
+        os.pwritev(self._cache_fd, [output.encode(), b"\n"], 0)
         self.polybar_hook_notify(self.HOOK_TAIL_ID)
+        return True
 
     def _create_cache_dir(self):
         """Ensures parent directory for cache file exists
@@ -585,19 +748,38 @@ class Controller(object):
         """Creates a unique cache file for the polybar module to read
         :effects: Writes a unique temporary local file specified by given args
         """
+        # kept open for the lifetime of the listener, see _redirect_output
+        self._cache_fd = os.open(
+            self._polybar_cache,
+            os.O_WRONLY | os.O_CREAT | os.O_TRUNC,
+            0o644,
+        )
+
+    def _install_signal_handlers(self):
+        """Sets up the traps that clean up the cache file on exit
+        :effects: Replaces the handlers of INT, QUIT, and TERM signals
+        """
+        signals = [signal.SIGINT, signal.SIGQUIT, signal.SIGTERM]
+        for sig in signals:
+            if sig not in signal.valid_signals():
+                continue
+            signal.signal(sig, self._destroy)
+
+    def _open_hook(self) -> int:
+        """Opens the polybar message queue for writing, without blocking
+        :return: File descriptor of the queue, or None when not available
+        """
+        hook = f"/tmp/polybar_mqueue.{self._polybar_pid}"
+        # notify only if polybar ipc is enabled
+        # see https://github.com/polybar/polybar/wiki/Module:-ipc for more info
         try:
-            os.mknod(self._polybar_cache, mode=0o644 | stat.S_IFREG)
-        except FileExistsError:
-            # clear contents
-            f = os.open(self._polybar_cache, os.O_WRONLY | os.O_NONBLOCK)
-            os.close(f)
-        finally:
-            # cleanup temp file on exit
-            signals = [signal.SIGINT, signal.SIGQUIT, signal.SIGTERM]
-            for sig in signals:
-                if sig not in signal.valid_signals():
-                    continue
-                signal.signal(sig, self._destroy)
+            fd = os.open(hook, os.O_WRONLY | os.O_NONBLOCK)
+        except OSError:
+            return None  # no such fifo, or polybar is not reading it
+        if not stat.S_ISFIFO(os.fstat(fd).st_mode):
+            os.close(fd)
+            return None
+        return fd
 
     @staticmethod
     def validate_polybar_pid(pid: int):
@@ -612,10 +794,11 @@ class Controller(object):
             pass
         else:
             # fetch process name of pid
-            cmd = f"ps -p {pid} -o comm=".split()
-            pipe = subprocess.run(cmd, capture_output=True, text=True)
-            if pipe.stdout.rstrip() == "polybar":
-                return True
+            try:
+                with open(f"/proc/{pid}/comm", "r") as f:
+                    return f.read().rstrip() == "polybar"
+            except OSError:
+                pass
         return False
 
     @property
@@ -624,10 +807,9 @@ class Controller(object):
 
     @cache_file.setter
     def cache_file(self, cache_path: str):
-        cache_parsed = pathlib.Path(cache_path)
         # format a unique name for temp file per polybar process
-        self._polybar_cache = str(cache_parsed.parent) + \
-            f"/{cache_parsed.name}.{self._polybar_pid}"
+        cache_path = os.path.normpath(cache_path)
+        self._polybar_cache = f"{cache_path}.{self._polybar_pid}"
 
         self._create_cache_dir()
         self._create_cache_file()
@@ -645,27 +827,29 @@ class Controller(object):
     def tail(cls, polybar_pid: int, cache_path=None) -> str:
         if cache_path is None:
             cache_path = f"{cls.CACHE_DIR}/window-list"
-        cache_path = str(pathlib.Path(cache_path)) + f".{polybar_pid}"
+        cache_path = f"{os.path.normpath(cache_path)}.{polybar_pid}"
         with open(cache_path, "r") as rc:
-            lines = rc.readlines()
-            print(lines[-1] if len(lines) != 0 else "", end="")
+            # the cache is overwritten in place, and only holds the last line
+            print(rc.read(), end="")
 
     def polybar_hook_notify(self, hook_id: int):
         """Sends an inter-processing commuication message to a polybar module
         :param hook_id: a 1-based index refering to the tail hook id
         """
-        hook = f"/tmp/polybar_mqueue.{self._polybar_pid}"
-        # notify only if polybar ipc is enabled
-        # see https://github.com/polybar/polybar/wiki/Module:-ipc for more info
-        if not os.path.exists(hook):
-            return
-        try:
-            if not stat.S_ISFIFO(os.stat(hook).st_mode):
+        message = f"hook:module/window-list{hook_id}\n".encode()
+        # the fifo is kept open between messages; when polybar has closed its
+        # end since the last one, it is opened again and the message resent
+        for _ in range(2):
+            if self._hook_fd is None:
+                self._hook_fd = self._open_hook()
+            if self._hook_fd is None:
                 return
-            with open(hook, "a") as f:
-                print(f"hook:module/window-list{hook_id}", file=f)
-        except FileNotFoundError:
-            pass
+            try:
+                os.write(self._hook_fd, message)
+                return
+            except OSError:
+                os.close(self._hook_fd)
+                self._hook_fd = None
 
     def start_listener(self):
         """Starts listening for bspwm events and reporting formatted output to
@@ -674,6 +858,7 @@ class Controller(object):
         # unique instance tied to polybar pid
         self.polybar_pid = self._polybar_pid
         if self._polybar_pid != 0:
+            self._install_signal_handlers()
             self.cache_file = self._polybar_cache
 
         d_node = NodeDriver()
@@ -682,17 +867,39 @@ class Controller(object):
         formatter = WindowInfoFormatter()
 
         o = WindowListInteractor(repo, formatter)
-        t: ThreadedRefresh = None
+        listener = EventListener()
+        selector = selectors.DefaultSelector()
         try:
-            event = EventListener.start()
+            listener.start()
+            selector.register(listener, selectors.EVENT_READ)
+            self._redirect_output(o.get_output())
+
+            last_event = time.monotonic()
+            unchanged = 0  # refreshes in a row that changed nothing
             while True:
-                self._redirect_output(o.get_output())
-                t = ThreadedRefresh(
-                    500, o.get_output, printer=self._redirect_output
-                )
-                t.start()
-                next(event)
-                t.stop()
+                idle = (time.monotonic() - last_event) * 1000
+                timeout = None  # refreshes stopped; wait for the next event
+                if idle < self.REFRESH_DELAY:
+                    timeout = (self.REFRESH_DELAY - idle) / 1000
+                elif idle < self.REFRESH_TIMEOUT:
+                    timeout = self.REFRESH_INTERVAL / 1000
+                    if unchanged >= self.REFRESH_BACKOFF_COUNT:
+                        timeout = self.REFRESH_BACKOFF_INTERVAL / 1000
+
+                wminfo_max_age = None  # refresh; fetch titles again
+                if selector.select(timeout):
+                    if not listener.read_events():
+                        continue  # no complete event yet
+                    last_event = time.monotonic()
+                    unchanged = 0
+                    # events only move focus and nodes around; window info is
+                    # fetched when a new window shows up, titles on refresh
+                    wminfo_max_age = math.inf
+                output = o.get_output(wminfo_max_age)
+                if self._redirect_output(output):
+                    unchanged = 0
+                else:
+                    unchanged += 1
         except (EOFError, KeyboardInterrupt):
             pass
         except Exception:
@@ -700,9 +907,8 @@ class Controller(object):
             self.polybar_hook_notify(self.HOOK_TAIL_ID)
             raise
         finally:
-            # stop remaining threads
-            if hasattr(t, "stop"):
-                t.stop()
+            selector.close()
+            listener.stop()
 
 
 def main(*args, **kwargs):